@@ -1,19 +1,23 @@
-import os
-from scripts.process_csv import   process_file, log_processed_file, read_processed_log, get_verified_email
+from scripts.raw_input import list_sessions
+from scripts.process_csv import   process_file, log_processed_file, read_processed_log, read_live_state, get_verified_email
 
 def main():
     raw_folder = 'data/raw/'
     processed_files = read_processed_log()
+    live_sessions = read_live_state()
     
-    for file_name in os.listdir(raw_folder):
-        if file_name.endswith('.csv') and file_name not in processed_files:
-            file_path = os.path.join(raw_folder, file_name)
-            print(f"Processing {file_name}...")
+    for session_name, file_path, member in list_sessions(raw_folder):
+        if session_name in live_sessions and session_name not in processed_files:
+            print(f"Skipping {session_name}, it is being uploaded by live_upload.py.")
+        elif session_name not in processed_files:
+            print(f"Processing {session_name}...")
             email = get_verified_email()
-            process_file(file_path, email)
-            log_processed_file(file_name, email)
+            process_file(file_path, email, member)
+            log_processed_file(session_name, email)
+            # The same session can appear more than once, e.g. as .csv and .csv.gz
+            processed_files[session_name] = email
         else:
-            print(f"Skipping {file_name}, already processed or not a CSV file.")
+            print(f"Skipping {session_name}, already processed.")
 
 
 
@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+
+accelerometer_cols = ['Accelerometer_X', 'Accelerometer_Y', 'Accelerometer_Z']
+gyro_cols = ['Gyro_X', 'Gyro_Y', 'Gyro_Z']
+
+# Width of the centered window used for motion energy, in seconds
+motion_window_seconds = 5
+
+# Mean squared deviation of the accelerometer magnitude from 1 g, in g^2
+accelerometer_energy_threshold = 0.05 ** 2
+
+# Mean squared gyro magnitude, in (deg/s)^2
+gyro_energy_threshold = 10 ** 2
+
+# Time masked around each Elements event, in seconds: (before, after)
+event_margins = {
+    '/muse/elements/blink': (1, 1),
+    '/muse/elements/jaw_clench': (1, 2),
+}
+
+
+def rolling_window_mean(times, values, window_seconds):
+    """
+    Computes the mean of values over a centered time window for every sample, in O(n)
+    using cumulative sums. NaN values are left out of both the sum and the count.
+
+    Parameters:
+    - times: Sorted timestamps as int64 nanoseconds.
+    - values: The values to average.
+    - window_seconds: The total width of the window.
+    """
+    valid = ~np.isnan(values)
+    value_sums = np.concatenate(([0.0], np.cumsum(np.where(valid, values, 0.0))))
+    value_counts = np.concatenate(([0], np.cumsum(valid)))
+
+    half_window = int(window_seconds * 1e9 / 2)
+    start = np.searchsorted(times, times - half_window, side='left')
+    end = np.searchsorted(times, times + half_window, side='right')
+
+    counts = value_counts[end] - value_counts[start]
+    sums = value_sums[end] - value_sums[start]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def add_motion_energy_columns(df, window_seconds=motion_window_seconds):
+    """
+    Adds rolling accelerometer and gyro motion energy columns to the DataFrame.
+    """
+    times = df['TimeStamp'].values.astype('int64')
+    accelerometer_magnitude = np.sqrt((df[accelerometer_cols].to_numpy(dtype=float) ** 2).sum(axis=1))
+    gyro_energy = (df[gyro_cols].to_numpy(dtype=float) ** 2).sum(axis=1)
+
+    df['Accelerometer_Energy'] = rolling_window_mean(times, (accelerometer_magnitude - 1) ** 2, window_seconds)
+    df['Gyro_Energy'] = rolling_window_mean(times, gyro_energy, window_seconds)
+
+
+def event_mask(times, event_times, before, after):
+    """
+    Returns a boolean array marking every sample that falls within [event - before, event + after]
+    of any event. The interval join is done with a sorted search instead of a loop over events.
+
+    Parameters:
+    - times: Sample timestamps as int64 nanoseconds.
+    - event_times: Event timestamps as int64 nanoseconds.
+    - before, after: Margins around each event, in seconds.
+    """
+    if len(event_times) == 0:
+        return np.zeros(len(times), dtype=bool)
+
+    starts = np.sort(event_times) - int(before * 1e9)
+    ends = starts + int((before + after) * 1e9)
+    # Latest interval end among all intervals that started at or before each sample
+    covered_until = np.maximum.accumulate(ends)
+
+    idx = np.searchsorted(starts, times, side='right') - 1
+    return (idx >= 0) & (covered_until[np.maximum(idx, 0)] >= times)
+
+
+def artifact_mask(df, events):
+    """
+    Returns a boolean Series marking the sensor rows contaminated by head movement, blinks or jaw clenches.
+
+    Parameters:
+    - df: The sensor rows, sorted by 'TimeStamp'.
+    - events: The event table with 'TimeStamp' and 'Elements' columns.
+    """
+    times = df['TimeStamp'].values.astype('int64')
+    mask = np.zeros(len(df), dtype=bool)
+
+    for element, (before, after) in event_margins.items():
+        event_times = events.loc[events['Elements'] == element, 'TimeStamp'].values.astype('int64')
+        mask |= event_mask(times, event_times, before, after)
+
+    add_motion_energy_columns(df)
+    mask |= (df['Accelerometer_Energy'] > accelerometer_energy_threshold).to_numpy()
+    mask |= (df['Gyro_Energy'] > gyro_energy_threshold).to_numpy()
+
+    return pd.Series(mask, index=df.index)
+
+
+def reject_artifacts(df, events):
+    """
+    Drops the sensor rows contaminated by motion or blink/jaw clench artifacts, so they never
+    reach the band power and metric calculations.
+
+    Parameters:
+    - df: The sensor rows.
+    - events: The event table with 'TimeStamp' and 'Elements' columns.
+    """
+    df = df.sort_values('TimeStamp', kind='stable')
+    contaminated = artifact_mask(df, events)
+
+    print(f"Rejected {contaminated.sum()} of {len(df)} samples as motion/blink artifacts.")
+    return df.loc[~contaminated].drop(columns=['Accelerometer_Energy', 'Gyro_Energy'])
@@ -0,0 +1,198 @@
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from data_transformations_copy import clean_and_transform_data, cols
+from raw_input import list_sessions, open_session
+
+raw_folder = 'data/raw/'
+processed_folder = 'data/processed/'
+
+# Each engine is timed this many times and the fastest run is reported
+timing_repeats = 5
+
+# Default tolerances: a value passes if |engine - reference| <= atol + rtol * |reference|
+default_rtol = 1e-9
+default_atol = 1e-12
+
+# Per-engine tolerance overrides, optionally per column: {engine: {'rtol': ..., 'atol': ..., 'columns': {col: (rtol, atol)}}}
+tolerances = {
+    'float32': {'rtol': 1e-4, 'atol': 1e-6},
+}
+
+
+def float32_engine(df):
+    """
+    Runs the reference pipeline with the band power columns stored as float32.
+    """
+    df = df.copy()
+    df[cols] = df[cols].astype('float32')
+    return clean_and_transform_data(df)
+
+
+# Engines compared against the reference. Register alternative implementations here.
+engines = {
+    'float32': float32_engine,
+}
+
+
+def synthetic_session(n_samples=3600, seed=0, start='2024-01-01 10:00:00'):
+    """
+    Generates a Mind Monitor-like session at 1 Hz: band powers, motion, HSI and heart rate, with
+    blink and jaw clench event rows interleaved, a few bad-contact spans and a head movement.
+    """
+    rng = np.random.default_rng(seed)
+    timestamps = pd.date_range(start, periods=n_samples, freq='1s')
+    df = pd.DataFrame({'TimeStamp': timestamps})
+
+    for col in cols:
+        df[col] = rng.normal(0.4, 0.3, n_samples)
+    for axis in ['X', 'Y', 'Z']:
+        df[f'Accelerometer_{axis}'] = rng.normal(0, 0.005, n_samples)
+        df[f'Gyro_{axis}'] = rng.normal(0, 1.0, n_samples)
+    df['Accelerometer_X'] -= 1
+    df['Heart_Rate'] = rng.normal(70, 3, n_samples)
+    df['HeadBandOn'] = 1
+    for sensor in ['TP9', 'AF7', 'AF8', 'TP10']:
+        df[f'HSI_{sensor}'] = rng.choice([1, 1, 1, 1, 2, 4], n_samples)
+    df['Battery'] = 80.0
+    df['Elements'] = np.nan
+
+    # A head movement and a span with the headband off
+    df.loc[n_samples // 3:n_samples // 3 + 10, ['Gyro_X', 'Gyro_Y']] = 60.0
+    df.loc[n_samples // 2:n_samples // 2 + 30, 'HeadBandOn'] = 0
+
+    n_events = max(n_samples // 200, 1)
+    events = pd.DataFrame({
+        'TimeStamp': np.sort(rng.choice(timestamps, n_events, replace=False)) + pd.Timedelta(milliseconds=500),
+        'Elements': rng.choice(['/muse/elements/blink', '/muse/elements/jaw_clench'], n_events),
+    })
+    return pd.concat([df, events]).sort_values('TimeStamp', kind='stable').reset_index(drop=True)
+
+
+def column_tolerance(engine_name, col):
+    """
+    Returns the (rtol, atol) used for a column of an engine.
+    """
+    engine_tolerances = tolerances.get(engine_name, {})
+    if col in engine_tolerances.get('columns', {}):
+        return engine_tolerances['columns'][col]
+    return engine_tolerances.get('rtol', default_rtol), engine_tolerances.get('atol', default_atol)
+
+
+def compare_outputs(reference, candidate, engine_name):
+    """
+    Compares every column of two pipeline outputs, aligned on 'TimeStamp'.
+    Returns a DataFrame with the max absolute and relative deviation per column and whether it passed.
+    """
+    reference = reference.set_index('TimeStamp')
+    candidate = candidate.set_index('TimeStamp')
+    rows = []
+
+    for col in reference.columns.union(candidate.columns, sort=False):
+        if col not in reference.columns or col not in candidate.columns:
+            rows.append({'column': col, 'max_abs': np.nan, 'max_rel': np.nan, 'passed': False,
+                         'note': 'missing in ' + ('engine' if col in reference.columns else 'reference')})
+            continue
+
+        expected, actual = reference[col].align(candidate[col], join='outer')
+        if not pd.api.types.is_numeric_dtype(expected):
+            passed = bool((expected.astype(str) == actual.astype(str)).all())
+            rows.append({'column': col, 'max_abs': np.nan, 'max_rel': np.nan, 'passed': passed, 'note': ''})
+            continue
+
+        expected = expected.to_numpy(dtype=float)
+        actual = actual.to_numpy(dtype=float)
+        both_nan = np.isnan(expected) & np.isnan(actual)
+        deviation = np.where(both_nan, 0.0, np.abs(actual - expected))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            relative = np.where(both_nan, 0.0, deviation / np.abs(expected))
+
+        rtol, atol = column_tolerance(engine_name, col)
+        within = both_nan | (deviation <= atol + rtol * np.abs(expected))
+        rows.append({
+            'column': col,
+            'max_abs': np.nanmax(deviation) if len(deviation) else 0.0,
+            'max_rel': np.nanmax(relative) if len(relative) else 0.0,
+            'passed': bool(within.all()),
+            'note': '' if len(expected) == len(reference) == len(candidate) else 'row count differs',
+        })
+
+    return pd.DataFrame(rows)
+
+
+def timed_against_reference(engine, df, repeats=timing_repeats):
+    """
+    Runs the reference and an engine alternately on fresh copies of the session, repeats times each,
+    and returns (reference output, fastest reference seconds, engine output, fastest engine seconds).
+    Alternating the runs and taking the fastest keeps cold caches and machine noise out of the speedup.
+    """
+    best = {}
+    outputs = {}
+    for _ in range(repeats):
+        for label, function in [('reference', clean_and_transform_data), ('engine', engine)]:
+            session = df.copy()
+            start = time.perf_counter()
+            outputs[label] = function(session)
+            seconds = time.perf_counter() - start
+            best[label] = min(best.get(label, seconds), seconds)
+    return outputs['reference'], best['reference'], outputs['engine'], best['engine']
+
+
+def run_engines(name, df):
+    """
+    Runs the reference and every registered engine on a session and prints the speedup and
+    the deviation of every column. Returns True if every engine matched the reference within tolerance.
+    """
+    all_passed = True
+
+    for engine_name, engine in engines.items():
+        reference, reference_seconds, output, seconds = timed_against_reference(engine, df)
+        report = compare_outputs(reference, output, engine_name)
+        passed = bool(report['passed'].all())
+        all_passed &= passed
+
+        print(f"{name} | {engine_name}: {'PASS' if passed else 'FAIL'}, "
+              f"speedup {reference_seconds / seconds:.2f}x, "
+              f"max abs deviation {report['max_abs'].max():.3g}, max rel deviation {report['max_rel'].max():.3g}")
+        print(report.to_string(index=False))
+
+    return all_passed
+
+
+def compare_golden(name, df, golden_path):
+    """
+    Compares the reference pipeline against a stored processed CSV and prints the deviation per column.
+    The stored file is informational only: it was produced by an earlier version of the pipeline.
+    """
+    golden = pd.read_csv(golden_path, parse_dates=['TimeStamp'])
+    reference = clean_and_transform_data(df.copy())
+    reference = reference.drop(columns=[col for col in reference.columns if col not in golden.columns])
+    report = compare_outputs(golden.drop(columns=['Email'], errors='ignore'), reference, 'golden')
+    print(f"{name} | reference vs {os.path.basename(golden_path)}:")
+    print(report.to_string(index=False))
+
+
+def main():
+    all_passed = True
+
+    for seed in range(3):
+        all_passed &= run_engines(f"synthetic-{seed}", synthetic_session(seed=seed))
+
+    for name, file_path, member in list_sessions(raw_folder):
+        with open_session(file_path, member) as stream:
+            df = pd.read_csv(stream)
+        df['TimeStamp'] = pd.to_datetime(df['TimeStamp'])
+        all_passed &= run_engines(name, df)
+
+        golden_path = os.path.join(processed_folder, f"processed_{name}")
+        if '--golden' in sys.argv and os.path.exists(golden_path):
+            compare_golden(name, df, golden_path)
+
+    sys.exit(0 if all_passed else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+
+sensors = ['TP9', 'AF7', 'AF8', 'TP10']
+hsi_cols = ['HSI_TP9', 'HSI_AF7', 'HSI_AF8', 'HSI_TP10']
+
+# Horseshoe indicator (HSI) values reported by Mind Monitor: 1 = good, 2 = medium, 4 = bad contact
+hsi_weights = {1: 1.0, 2: 0.5, 4: 0.0}
+
+# Channel groups the metrics are averaged over: AVG, Frontal and Posterior
+channel_groups = [('TP9', 'AF7', 'AF8', 'TP10'), ('AF7', 'AF8'), ('TP9', 'TP10')]
+
+
+def channel_weights(df):
+    """
+    Returns an array of shape (samples, sensors) with the weight of every channel, derived from the HSI columns.
+    Unknown HSI values and samples with HeadBandOn = 0 get a weight of 0.
+    """
+    hsi = df[hsi_cols].to_numpy(dtype=float)
+    weights = np.zeros_like(hsi)
+    for hsi_value, weight in hsi_weights.items():
+        weights[hsi == hsi_value] = weight
+
+    headband_on = (df['HeadBandOn'] == 1).to_numpy()
+    weights[~headband_on] = 0.0
+
+    return weights
+
+
+def usable_rows(weights):
+    """
+    Returns a boolean array marking the samples where at least one channel has usable contact.
+    """
+    return (weights > 0).any(axis=1)
+
+
+def group_weights(weights):
+    """
+    Splits the channel weights into the weights and bad-contact mask of every channel group, so they
+    are computed once per session and shared by all metrics.
+    Returns a dict {sensor tuple: (weights, mask)}, see weighted_channel_mean.
+    """
+    groups = {}
+    for group in channel_groups:
+        positions = [sensors.index(sensor) for sensor in group]
+        weights_group = weights[:, positions]
+        groups[group] = (weights_group, weights_group == 0)
+    return groups
+
+
+def weighted_channel_mean(values, weights=None):
+    """
+    Averages per-channel columns, weighting each channel by its contact quality.
+    Channels with a weight of 0 are masked out. Without weights this is a plain mean.
+
+    Parameters:
+    - values: DataFrame with one column per channel, named '<Name>_<sensor>' (e.g. 'Creativity_AF7'),
+      row-aligned with the weights.
+    - weights: dict returned by group_weights, or None.
+    """
+    if weights is None:
+        return values.mean(axis=1)
+
+    channel_weights, bad_contact = weights[tuple(col.split('_')[1] for col in values.columns)]
+    masked_values = np.ma.masked_array(values.to_numpy(dtype=float), mask=bad_contact)
+    average = np.ma.average(masked_values, weights=channel_weights, axis=1)
+
+    return pd.Series(average.filled(np.nan), index=values.index)
@@ -1,4 +1,7 @@
+import numpy as np
 import pandas as pd
+from artifact_rejection import reject_artifacts
+from contact_quality import channel_weights, usable_rows, group_weights, weighted_channel_mean, hsi_cols
 
 # Define the columns for each band
 delta_cols = ['Delta_TP9', 'Delta_AF7', 'Delta_AF8', 'Delta_TP10']
@@ -10,46 +13,95 @@ gamma_cols = ['Gamma_TP9', 'Gamma_AF7', 'Gamma_AF8', 'Gamma_TP10']
 # List of all band columns
 cols = delta_cols + theta_cols + alpha_cols + beta_cols + gamma_cols
 
+# Ratio metrics, scaled to the session maximum by normalize_metric_columns
+metric_cols = [f'{metric}_{region}'
+               for metric in ['Creativity', 'Relaxation', 'Relaxation2', 'Regeneration', 'Engagement', 'EngagementV2']
+               for region in ['AVG', 'Frontal', 'Posterior']]
+
 
 def clean_and_transform_data(df):
     """
     Cleans the DataFrame by dropping nulls, selecting necessary columns, and transforming EEG power values.
     """
-    df = df.drop(columns=['Elements'])
-    # Drop rows with any null values
-    df = df.dropna()
+    df = compute_sample_metrics(df)
+    return aggregate_minute_bins(df)
 
-    # Select necessary columns
+
+def compute_sample_metrics(df, normalize=True):
+    """
+    Cleans the DataFrame and computes the band powers and metrics for every sample, before any time aggregation.
+    With normalize=False the ratio metrics are returned unscaled, see normalize_metric_columns.
+    """
+    # Route event rows (blinks, jaw clenches, connection events) to their own table
+    df, events = split_event_rows(df)
+
+    # Drop samples contaminated by head movement, blinks and jaw clenches
+    df = reject_artifacts(df, events)
+
+    # Drop rows with null values, checking only the columns used below
     necessary_columns = ['TimeStamp', 'Heart_Rate'] + cols
+    df = df.dropna(subset=necessary_columns + hsi_cols + ['HeadBandOn'])
+
+    # Weight each channel by its contact quality and skip samples without any usable channel.
+    # The weights and masks of every channel group are built once and shared by all metrics.
+    weights = channel_weights(df)
+    usable = usable_rows(weights)
+    df = df[usable]
+    weights = group_weights(weights[usable])
+
+    # Select necessary columns
     df = df[necessary_columns]
 
-    
 
     # Apply log relative power transformation
     add_log_relative_power_columns(df, cols)
 
     # Add average, frontal, and posterior columns for each frequency band
-    add_band_average_columns(df)
+    add_band_average_columns(df, weights)
 
     # Add creativity metrics
-    add_creativity_metrics(df)
+    add_creativity_metrics(df, weights)
 
     # Add relaxation metrics
-    add_relaxation_metrics(df)
-    add_relaxation_metrics_2(df)
+    add_relaxation_metrics(df, weights)
+    add_relaxation_metrics_2(df, weights)
 
     # Add regeneration metrics
-    add_regeneration_metrics(df)
+    add_regeneration_metrics(df, weights)
 
     # Add engagement metrics
-    add_engagement_metrics(df)
-    add_engagement_metrics_v2(df)
+    add_engagement_metrics(df, weights)
+    add_engagement_metrics_v2(df, weights)
 
     # Calculate and add the HRV column
     add_hrv_column(df)
 
+    # Scale the metrics to the session maximum
+    if normalize:
+        normalize_metric_columns(df)
+
+    return df
+
+
+def normalize_metric_columns(df):
+    """
+    Scales every ratio metric so that its session maximum is 100.
+    The add_*_metrics functions leave the ratios unscaled, so this runs once, after all of them.
+    """
+    for col in metric_cols:
+        # df[col] = (df[col] - df[col].min()) / (df[col].max() - df[col].min())
+        df[col] = (df[col]  / df[col].max() )*100
+
+
+def aggregate_minute_bins(df, trim_start=3, trim_end=3):
+    """
+    Aggregates the per-sample metrics into 1-minute bins, ready for upload.
+    Minutes without any sample left (headband off, bad contact, artifacts) are dropped,
+    then the first trim_start and last trim_end bins.
+    """
     # Resample the data to 1-minute intervals
     df = resample_data(df)
+    df = df.dropna(how='all', subset=df.columns.drop('TimeStamp')).reset_index(drop=True)
 
     # Add the Sleep/Awake column
     add_sleep_awake_column(df)
@@ -60,10 +112,26 @@ def clean_and_transform_data(df):
     df.drop(cols, axis=1, inplace=True)
 
     # Drop first 3 and last 3 rows
-    df = df.iloc[3:-3]
+    df = df.iloc[trim_start:len(df) - trim_end]
     
     return df
 
+
+def split_event_rows(df):
+    """
+    Splits the raw Mind Monitor rows into sensor rows and events in one pass over the 'Elements' column.
+    Event rows only carry 'TimeStamp' and 'Elements' (e.g. '/muse/elements/blink'), so they are returned
+    as a compact table of just those two columns. The sensor rows are returned without 'Elements'.
+    """
+    is_event = df['Elements'].notna().to_numpy()
+
+    events = df.loc[is_event, ['TimeStamp', 'Elements']].reset_index(drop=True)
+    events['Elements'] = events['Elements'].astype('category')
+    sensors = df.loc[~is_event].drop(columns=['Elements'])
+
+    return sensors, events
+
+
 def resample_data(df):
     """
     Resamples the DataFrame to 1-minute intervals, aggregating values by their mean in each interval.
@@ -80,6 +148,59 @@ def resample_data(df):
     return df_resampled
 
 
+def aggregate_sliding_windows(df, window_seconds=30, step_seconds=1):
+    """
+    Aggregates the per-sample metrics into overlapping windows of window_seconds, one every step_seconds.
+    """
+    df = sliding_window_data(df, window_seconds, step_seconds)
+
+    # Add the Sleep/Awake column
+    add_sleep_awake_column(df)
+
+    # Drop the unnecessary columns
+    df.drop(cols, axis=1, inplace=True)
+
+    return df
+
+
+def sliding_window_data(df, window_seconds, step_seconds):
+    """
+    Averages every numeric column over a sliding window of window_seconds, evaluated every step_seconds.
+    Each row is labelled with the end of its window and covers (end - window, end].
+    Window sums come from one cumulative sum per column, so the cost does not depend on the window width.
+    Windows without any sample are left out.
+    """
+    times = df['TimeStamp'].values.astype('int64')
+    order = np.argsort(times, kind='stable')
+    times = times[order]
+    value_cols = df.drop(columns=['TimeStamp']).select_dtypes(include='number').columns
+    values = df[value_cols].to_numpy(dtype=float)[order]
+
+    if len(times) == 0:
+        return pd.DataFrame(columns=['TimeStamp'] + list(value_cols))
+
+    valid = ~np.isnan(values)
+    value_sums = np.vstack([np.zeros(len(value_cols)), np.cumsum(np.where(valid, values, 0.0), axis=0)])
+    value_counts = np.vstack([np.zeros(len(value_cols)), np.cumsum(valid, axis=0)])
+
+    window = int(window_seconds * 1e9)
+    step = int(step_seconds * 1e9)
+    first_end = -(-times[0] // step) * step
+    window_ends = np.arange(first_end, times[-1] + step, step)
+
+    start = np.searchsorted(times, window_ends - window, side='right')
+    end = np.searchsorted(times, window_ends, side='right')
+
+    counts = value_counts[end] - value_counts[start]
+    sums = value_sums[end] - value_sums[start]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(counts > 0, sums / counts, np.nan)
+
+    df_windows = pd.DataFrame(means, columns=value_cols)
+    df_windows.insert(0, 'TimeStamp', pd.to_datetime(window_ends))
+    return df_windows[end > start].reset_index(drop=True)
+
+
 def add_dummy_column(df):
     """
     Adds a dummy column with all values set to 'dummy'.
@@ -101,7 +222,7 @@ def add_sleep_awake_column(df):
     df['Awake'] = (df['Beta_AVG'] + df['Alpha_AVG'] ) / 2
 
 
-def add_band_average_columns(df):
+def add_band_average_columns(df, weights=None):
     """
     Adds average, frontal, and posterior columns for each frequency band.
     """
@@ -117,19 +238,19 @@ def add_band_average_columns(df):
     for band_name, band_cols in bands.items():
         # Calculate and add the average column for the current band
         
-        df[f'{band_name}_AVG'] = df[band_cols].mean(axis=1)
+        df[f'{band_name}_AVG'] = weighted_channel_mean(df[band_cols], weights)
         #format 7 decimal places
         #df[f'{band_name}_AVG_rel'] = df[f'{band_name}_AVG_rel'].map(lambda x: format(x, '.3f'))
         
         # Frontal columns are those ending with 'AF7' and 'AF8'
         frontal_cols = [col for col in band_cols if col.endswith('AF7') or col.endswith('AF8')]
-        df[f'{band_name}_Frontal'] = df[frontal_cols].mean(axis=1)
+        df[f'{band_name}_Frontal'] = weighted_channel_mean(df[frontal_cols], weights)
         #format 7 decimal places
         #df[f'{band_name}_Frontal_rel'] = df[f'{band_name}_Frontal_rel'].map(lambda x: format(x, '.3f'))
         
         # Posterior columns are those ending with 'TP9' and 'TP10'
         posterior_cols = [col for col in band_cols if col.endswith('TP9') or col.endswith('TP10')]
-        df[f'{band_name}_Posterior'] = df[posterior_cols].mean(axis=1)
+        df[f'{band_name}_Posterior'] = weighted_channel_mean(df[posterior_cols], weights)
         #format 7 decimal places
         #df[f'{band_name}_Posterior_rel'] = df[f'{band_name}_Posterior_rel'].map(lambda x: format(x, '.3f'))
 
@@ -157,7 +278,7 @@ def add_log_relative_power_columns(df, band_cols):
 
 
 
-def add_creativity_metrics(df):
+def add_creativity_metrics(df, weights=None):
     """
     Adds creativity metrics by first converting theta and beta power values from dB to a linear scale
     for the purpose of these calculations, then dividing theta power columns by beta columns for each sensor,
@@ -174,29 +295,22 @@ def add_creativity_metrics(df):
         creativity_df[creativity_col] = df[theta_col] / df[beta_col]
 
     # Calculate Creativity_AVG and add it to the original DataFrame
-    df['Creativity_AVG'] = creativity_df.mean(axis=1)
+    df['Creativity_AVG'] = weighted_channel_mean(creativity_df, weights)
 
-    # Calculate Creativity_Frontal, normalize to show as percentage, and add it to the original DataFrame
+    # Calculate Creativity_Frontal and add it to the original DataFrame
     creativity_frontal_cols = [col for col in creativity_df.columns if 'AF7' in col or 'AF8' in col]
-    df['Creativity_Frontal'] = creativity_df[creativity_frontal_cols].mean(axis=1)
-   # df['Creativity_Frontal'] = (df['Creativity_Frontal'] / df['Creativity_Frontal'].max()) * 100
+    df['Creativity_Frontal'] = weighted_channel_mean(creativity_df[creativity_frontal_cols], weights)
 
-    # Calculate Creativity_Posterior, normalize to show as percentage, and add it to the original DataFrame
+    # Calculate Creativity_Posterior and add it to the original DataFrame
     creativity_posterior_cols = [col for col in creativity_df.columns if 'TP9' in col or 'TP10' in col]
-    df['Creativity_Posterior'] = creativity_df[creativity_posterior_cols].mean(axis=1)
-    #df['Creativity_Posterior'] = (df['Creativity_Posterior'] / df['Creativity_Posterior'].max()) * 100
-
-    # Apply Min-Max normalization to the creativity metrics
-    for col in ['Creativity_AVG','Creativity_Frontal', 'Creativity_Posterior']:
-        # df[col] = (df[col] - df[col].min()) / (df[col].max() - df[col].min())*100
-        df[col] = (df[col]  / df[col].max() )*100
+    df['Creativity_Posterior'] = weighted_channel_mean(creativity_df[creativity_posterior_cols], weights)
 
 
-def add_relaxation_metrics(df):
+def add_relaxation_metrics(df, weights=None):
     """
     Adds relaxation metrics by converting theta and alpha power values from dB to a linear scale,
     then dividing theta power columns by alpha columns for each sensor, and calculates average,
-    frontal, and posterior relaxation metrics with Min-Max normalization.
+    frontal, and posterior relaxation metrics.
     """
     # Initialize a temporary DataFrame for relaxation calculations
     relaxation_df = pd.DataFrame()
@@ -209,25 +323,20 @@ def add_relaxation_metrics(df):
         relaxation_df[relaxation_col] = df[theta_col] / df[alpha_col]
 
     # Calculate Relaxation_AVG and add it to the original DataFrame
-    df['Relaxation_AVG'] = relaxation_df.mean(axis=1)
+    df['Relaxation_AVG'] = weighted_channel_mean(relaxation_df, weights)
 
     # Calculate Relaxation_Frontal and Relaxation_Posterior
     relaxation_frontal_cols = [col for col in relaxation_df.columns if 'AF7' in col or 'AF8' in col]
-    df['Relaxation_Frontal'] = relaxation_df[relaxation_frontal_cols].mean(axis=1)
+    df['Relaxation_Frontal'] = weighted_channel_mean(relaxation_df[relaxation_frontal_cols], weights)
     
     relaxation_posterior_cols = [col for col in relaxation_df.columns if 'TP9' in col or 'TP10' in col]
-    df['Relaxation_Posterior'] = relaxation_df[relaxation_posterior_cols].mean(axis=1)
-
-    # Apply Min-Max normalization to the relaxation metrics
-    for col in ['Relaxation_AVG', 'Relaxation_Frontal', 'Relaxation_Posterior']:
-        #df[col] = (df[col] - df[col].min()) / (df[col].max() - df[col].min())
-        df[col] = (df[col]  / df[col].max() )*100
+    df['Relaxation_Posterior'] = weighted_channel_mean(relaxation_df[relaxation_posterior_cols], weights)
 
-def add_relaxation_metrics_2(df):
+def add_relaxation_metrics_2(df, weights=None):
     """
     Adds relaxation metrics by converting theta and alpha power values from dB to a linear scale,
     then dividing theta power columns by alpha columns for each sensor, and calculates average,
-    frontal, and posterior relaxation metrics with Min-Max normalization.
+    frontal, and posterior relaxation metrics.
     """
     # Initialize a temporary DataFrame for relaxation calculations
     relaxation_df = pd.DataFrame()
@@ -240,26 +349,21 @@ def add_relaxation_metrics_2(df):
         relaxation_df[relaxation_col] = df[alpha_col] / df[beta_col]
 
     # Calculate Relaxation_AVG and add it to the original DataFrame
-    df['Relaxation2_AVG'] = relaxation_df.mean(axis=1)
+    df['Relaxation2_AVG'] = weighted_channel_mean(relaxation_df, weights)
 
     # Calculate Relaxation_Frontal and Relaxation_Posterior
     relaxation_frontal_cols = [col for col in relaxation_df.columns if 'AF7' in col or 'AF8' in col]
-    df['Relaxation2_Frontal'] = relaxation_df[relaxation_frontal_cols].mean(axis=1)
+    df['Relaxation2_Frontal'] = weighted_channel_mean(relaxation_df[relaxation_frontal_cols], weights)
     
     relaxation_posterior_cols = [col for col in relaxation_df.columns if 'TP9' in col or 'TP10' in col]
-    df['Relaxation2_Posterior'] = relaxation_df[relaxation_posterior_cols].mean(axis=1)
+    df['Relaxation2_Posterior'] = weighted_channel_mean(relaxation_df[relaxation_posterior_cols], weights)
 
-    # Apply Min-Max normalization to the relaxation metrics
-    for col in ['Relaxation2_AVG', 'Relaxation2_Frontal', 'Relaxation2_Posterior']:
-        # df[col] = (df[col] - df[col].min()) / (df[col].max() - df[col].min())
-        df[col] = (df[col]  / df[col].max() )*100
 
-
-def add_regeneration_metrics(df):
+def add_regeneration_metrics(df, weights=None):
     """
     Adds regeneration metrics by converting alpha and delta power values from dB to a linear scale,
     then dividing alpha power columns by delta columns for each sensor, and calculates average,
-    frontal, and posterior regeneration metrics with Min-Max normalization.
+    frontal, and posterior regeneration metrics.
     """
     # Initialize a temporary DataFrame for regeneration calculations
     regeneration_df = pd.DataFrame()
@@ -272,26 +376,21 @@ def add_regeneration_metrics(df):
         regeneration_df[regeneration_col] = df[alpha_col] / df[delta_col]
 
     # Calculate Regeneration_AVG and add it to the original DataFrame
-    df['Regeneration_AVG'] = regeneration_df.mean(axis=1)
+    df['Regeneration_AVG'] = weighted_channel_mean(regeneration_df, weights)
 
     # Calculate Regeneration_Frontal and Regeneration_Posterior
     regeneration_frontal_cols = [col for col in regeneration_df.columns if 'AF7' in col or 'AF8' in col]
-    df['Regeneration_Frontal'] = regeneration_df[regeneration_frontal_cols].mean(axis=1)
+    df['Regeneration_Frontal'] = weighted_channel_mean(regeneration_df[regeneration_frontal_cols], weights)
     
     regeneration_posterior_cols = [col for col in regeneration_df.columns if 'TP9' in col or 'TP10' in col]
-    df['Regeneration_Posterior'] = regeneration_df[regeneration_posterior_cols].mean(axis=1)
-
-    # Apply Min-Max normalization to the regeneration metrics
-    for col in ['Regeneration_AVG', 'Regeneration_Frontal', 'Regeneration_Posterior']:
-        # df[col] = (df[col] - df[col].min()) / (df[col].max() - df[col].min())
-        df[col] = (df[col]  / df[col].max() )*100
+    df['Regeneration_Posterior'] = weighted_channel_mean(regeneration_df[regeneration_posterior_cols], weights)
 
 
-def add_engagement_metrics(df):
+def add_engagement_metrics(df, weights=None):
     """
     Adds engagement metrics by converting beta, alpha, and theta power values from dB to a linear scale,
     then dividing beta power columns by the sum of alpha and theta columns for each sensor, and calculates
-    average, frontal, and posterior engagement metrics with Min-Max normalization.
+    average, frontal, and posterior engagement metrics.
     """
     # Initialize a temporary DataFrame for engagement calculations
     engagement_df = pd.DataFrame()
@@ -305,25 +404,20 @@ def add_engagement_metrics(df):
         engagement_df[engagement_col] = df[beta_col] / (df[alpha_col] + df[theta_col])
 
     # Calculate Engagement_AVG and add it to the original DataFrame
-    df['Engagement_AVG'] = engagement_df.mean(axis=1)
+    df['Engagement_AVG'] = weighted_channel_mean(engagement_df, weights)
 
     # Calculate Engagement_Frontal and Engagement_Posterior
     engagement_frontal_cols = [col for col in engagement_df.columns if 'AF7' in col or 'AF8' in col]
-    df['Engagement_Frontal'] = engagement_df[engagement_frontal_cols].mean(axis=1)
+    df['Engagement_Frontal'] = weighted_channel_mean(engagement_df[engagement_frontal_cols], weights)
     
     engagement_posterior_cols = [col for col in engagement_df.columns if 'TP9' in col or 'TP10' in col]
-    df['Engagement_Posterior'] = engagement_df[engagement_posterior_cols].mean(axis=1)
-
-    # Apply Min-Max normalization to the engagement metrics
-    for col in ['Engagement_AVG', 'Engagement_Frontal', 'Engagement_Posterior']:
-        # df[col] = (df[col] - df[col].min()) / (df[col].max() - df[col].min())
-        df[col] = (df[col]  / df[col].max() )*100
+    df['Engagement_Posterior'] = weighted_channel_mean(engagement_df[engagement_posterior_cols], weights)
 
 
-def add_engagement_metrics_v2(df):
+def add_engagement_metrics_v2(df, weights=None):
     """
     Adds engagement metrics using the formula (Delta + Theta) / (Beta + Alpha) for each sensor,
-    then calculates average, frontal, and posterior engagement metrics with Min-Max normalization.
+    then calculates average, frontal, and posterior engagement metrics.
     """
     # Initialize a temporary DataFrame for engagement calculations
     engagement_df_v2 = pd.DataFrame()
@@ -339,19 +433,14 @@ def add_engagement_metrics_v2(df):
         engagement_df_v2[engagement_col_v2] = (df[delta_col] + df[theta_col]) / (df[beta_col] + df[alpha_col])
 
     # Calculate EngagementV2_AVG and add it to the original DataFrame
-    df['EngagementV2_AVG'] = engagement_df_v2.mean(axis=1)
+    df['EngagementV2_AVG'] = weighted_channel_mean(engagement_df_v2, weights)
 
     # Calculate EngagementV2_Frontal and EngagementV2_Posterior
     engagement_frontal_cols_v2 = [col for col in engagement_df_v2.columns if 'AF7' in col or 'AF8' in col]
-    df['EngagementV2_Frontal'] = engagement_df_v2[engagement_frontal_cols_v2].mean(axis=1)
+    df['EngagementV2_Frontal'] = weighted_channel_mean(engagement_df_v2[engagement_frontal_cols_v2], weights)
     
     engagement_posterior_cols_v2 = [col for col in engagement_df_v2.columns if 'TP9' in col or 'TP10' in col]
-    df['EngagementV2_Posterior'] = engagement_df_v2[engagement_posterior_cols_v2].mean(axis=1)
-
-    # Apply Min-Max normalization to the engagement metrics
-    for col in ['EngagementV2_AVG', 'EngagementV2_Frontal', 'EngagementV2_Posterior']:
-        # df[col] = (df[col] - df[col].min()) / (df[col].max() - df[col].min())
-        df[col] = (df[col]  / df[col].max() )*100
+    df['EngagementV2_Posterior'] = weighted_channel_mean(engagement_df_v2[engagement_posterior_cols_v2], weights)
 
 
 
@@ -0,0 +1,189 @@
+import json
+import os
+
+import numpy as np
+
+# One JSON file of sketches per subject
+sketches_folder = 'data/sketches'
+
+# Quantiles are answered within this relative error
+relative_accuracy = 0.01
+gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+log_gamma = np.log(gamma)
+
+
+def sketch_values(values):
+    """
+    Builds a mergeable summary of the values: count, sum, sum of squares, min, max and a
+    log-bucketed quantile sketch (DDSketch-style). Merging two sketches gives exactly the
+    sketch of the combined values, so population statistics never need the raw rows.
+    """
+    values = np.asarray(values, dtype=float)
+    values = values[np.isfinite(values)]
+
+    positive = values[values > 0]
+    negative = -values[values < 0]
+    sketch = {
+        'count': int(len(values)),
+        'sum': float(values.sum()),
+        'sum_sq': float((values ** 2).sum()),
+        'min': float(values.min()) if len(values) else None,
+        'max': float(values.max()) if len(values) else None,
+        'zero': int((values == 0).sum()),
+        'positive': bucket_counts(positive),
+        'negative': bucket_counts(negative),
+    }
+    return sketch
+
+
+def bucket_counts(values):
+    """
+    Counts positive values per logarithmic bucket. Keys are strings so the result is JSON-ready.
+    """
+    if len(values) == 0:
+        return {}
+    buckets, counts = np.unique(np.ceil(np.log(values) / log_gamma).astype(int), return_counts=True)
+    return {str(bucket): int(count) for bucket, count in zip(buckets, counts)}
+
+
+def merge_sketches(a, b):
+    """
+    Merges two sketches into a new one.
+    """
+    if a is None:
+        return b
+    if b is None:
+        return a
+
+    mins = [x for x in [a['min'], b['min']] if x is not None]
+    maxs = [x for x in [a['max'], b['max']] if x is not None]
+    merged = {
+        'count': a['count'] + b['count'],
+        'sum': a['sum'] + b['sum'],
+        'sum_sq': a['sum_sq'] + b['sum_sq'],
+        'min': min(mins) if mins else None,
+        'max': max(maxs) if maxs else None,
+        'zero': a['zero'] + b['zero'],
+    }
+    for store in ['positive', 'negative']:
+        buckets = dict(a[store])
+        for bucket, count in b[store].items():
+            buckets[bucket] = buckets.get(bucket, 0) + count
+        merged[store] = buckets
+    return merged
+
+
+def sketch_quantile(sketch, q):
+    """
+    Returns the approximate q-quantile (0 <= q <= 1) of the sketched values.
+    """
+    if sketch['count'] == 0:
+        return None
+
+    # Walk the buckets in value order: negatives (largest magnitude first), zeros, positives
+    negative = sorted(((int(b), c) for b, c in sketch['negative'].items()), reverse=True)
+    positive = sorted((int(b), c) for b, c in sketch['positive'].items())
+    rank = q * (sketch['count'] - 1)
+
+    seen = 0
+    for bucket, count in negative:
+        seen += count
+        if seen > rank:
+            return -bucket_value(bucket)
+    seen += sketch['zero']
+    if seen > rank:
+        return 0.0
+    for bucket, count in positive:
+        seen += count
+        if seen > rank:
+            return bucket_value(bucket)
+    return sketch['max']
+
+
+def bucket_value(bucket):
+    """
+    Returns the representative value of a bucket, within relative_accuracy of every value in it.
+    """
+    return 2 * gamma ** bucket / (gamma + 1)
+
+
+def sketch_mean_std(sketch):
+    """
+    Returns the mean and (population) standard deviation of the sketched values.
+    """
+    if sketch['count'] == 0:
+        return None, None
+    mean = sketch['sum'] / sketch['count']
+    variance = max(sketch['sum_sq'] / sketch['count'] - mean ** 2, 0.0)
+    return mean, variance ** 0.5
+
+
+def z_score(sketch, value):
+    """
+    Returns the z-score of value against the sketched distribution.
+    """
+    mean, std = sketch_mean_std(sketch)
+    if not std:
+        return None
+    return (value - mean) / std
+
+
+def subject_sketch_path(email):
+    """
+    Returns the path of the sketch file of a subject.
+    """
+    subject = email.replace('@', '_at_').replace('.', '_')
+    return os.path.join(sketches_folder, f"{subject}.json")
+
+
+def read_subject_sketches(email):
+    """
+    Reads the sketches of a subject. Returns an empty record if the subject has none yet.
+    """
+    try:
+        with open(subject_sketch_path(email), 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {'email': email, 'sessions': [], 'columns': {}}
+
+
+def update_subject_sketches(df, email, session_name):
+    """
+    Sketches every numeric column of a processed session and merges it into the subject's sketch file.
+    A session that has already been merged is skipped so it is never counted twice.
+
+    Parameters:
+    - df: The per-sample metrics of the session, with the ratio metrics not yet scaled to the
+      session maximum (compute_sample_metrics(df, normalize=False)), so sessions are comparable.
+    - email: The subject the session belongs to.
+    - session_name: The name of the session, recorded to avoid merging it twice.
+    """
+    record = read_subject_sketches(email)
+    if session_name in record['sessions']:
+        print(f"Sketches for {session_name} already merged, skipping.")
+        return
+
+    for col in df.drop(columns=['TimeStamp'], errors='ignore').select_dtypes(include='number').columns:
+        record['columns'][col] = merge_sketches(record['columns'].get(col), sketch_values(df[col].to_numpy()))
+    record['sessions'].append(session_name)
+
+    os.makedirs(sketches_folder, exist_ok=True)
+    with open(subject_sketch_path(email), 'w') as file:
+        json.dump(record, file, separators=(',', ':'))
+
+
+def population_sketch(column, emails=None):
+    """
+    Merges the sketches of a column across subjects (all subjects if emails is None).
+    """
+    if emails is None:
+        paths = [os.path.join(sketches_folder, name) for name in sorted(os.listdir(sketches_folder))
+                 if name.endswith('.json')]
+    else:
+        paths = [subject_sketch_path(email) for email in emails]
+
+    merged = None
+    for path in paths:
+        with open(path, 'r') as file:
+            merged = merge_sketches(merged, json.load(file)['columns'].get(column))
+    return merged
@@ -0,0 +1,217 @@
+import json
+import os
+import sys
+import time
+
+import pandas as pd
+from gspread.utils import rowcol_to_a1
+from data_transformations_copy import compute_sample_metrics, normalize_metric_columns, aggregate_minute_bins
+from process_csv import archive_session, get_verified_email, log_processed_file, live_state_path, read_live_state
+from raw_input import open_session, session_name
+from sheet_shards import upload_to_shards, serialize_for_sheets
+from upload_to_sheets import authenticate_gsheets
+
+# How often the recording is checked for new minutes
+upload_interval_seconds = 60
+
+# The session is finished when the file has not grown for this long
+idle_timeout_seconds = 300
+
+
+def write_live_state(state):
+    """
+    Writes the live upload state to disk.
+    """
+    with open(live_state_path, 'w') as file:
+        json.dump(state, file)
+
+
+def read_samples(file_path):
+    """
+    Reads a recording in progress and returns its per-sample metrics, with the ratio metrics
+    not scaled to the session maximum, and the time of its last sample.
+    """
+    with open_session(file_path) as stream:
+        df = pd.read_csv(stream)
+    df['TimeStamp'] = pd.to_datetime(df['TimeStamp'])
+    return compute_sample_metrics(df, normalize=False), df['TimeStamp'].max()
+
+
+def live_minute_bins(samples, email, last_sample, final=False):
+    """
+    Returns the 1-minute bins of the samples. While recording, the minute the recording is currently in
+    is left out and the last minutes are kept; once the session is final, the bins are trimmed like
+    the batch upload.
+    """
+    if final:
+        bins = aggregate_minute_bins(samples.copy())
+    else:
+        bins = aggregate_minute_bins(samples.copy(), trim_end=0)
+        bins = bins[bins['TimeStamp'] + pd.Timedelta(minutes=1) <= last_sample]
+
+    bins = bins.reset_index(drop=True)
+    bins['Email'] = email
+    return bins
+
+
+def changed_cell_ranges(row_number, old_values, new_values):
+    """
+    Returns batch_update ranges covering only the cells of a row that changed,
+    one range per run of adjacent changed cells.
+    """
+    ranges = []
+    run_start = None
+    for col, (old, new) in enumerate(zip(old_values + [None], new_values + [None])):
+        changed = col < len(new_values) and json.dumps(old) != json.dumps(new)
+        if changed and run_start is None:
+            run_start = col
+        elif not changed and run_start is not None:
+            ranges.append({
+                'range': f"{rowcol_to_a1(row_number, run_start + 1)}:{rowcol_to_a1(row_number, col)}",
+                'values': [new_values[run_start:col]],
+            })
+            run_start = None
+    return ranges
+
+
+def revise_rows(session, bins):
+    """
+    Overwrites the cells of already uploaded minutes whose values differ from bins,
+    with one batch_update per worksheet. Returns the number of rows revised.
+    """
+    serialized = serialize_for_sheets(bins)
+    values = serialized.values.tolist()
+
+    updates = {}
+    revised = 0
+    for index, timestamp in serialized['TimeStamp'].items():
+        row = session['rows'].get(timestamp)
+        if row is None:
+            continue
+        sheet_id, worksheet, row_number = row['location']
+        ranges = changed_cell_ranges(row_number, row['values'], values[index])
+        if ranges:
+            updates.setdefault((sheet_id, worksheet), []).extend(ranges)
+            row['values'] = values[index]
+            revised += 1
+
+    if updates:
+        client = authenticate_gsheets()
+        for (sheet_id, worksheet), ranges in updates.items():
+            client.open_by_key(sheet_id).worksheet(worksheet).batch_update(ranges, value_input_option='USER_ENTERED')
+    return revised
+
+
+def clear_rows(session, timestamps):
+    """
+    Clears the uploaded rows whose minute is not in timestamps, with one batch_clear per worksheet,
+    and forgets them. The rows are cleared rather than deleted so the recorded location of every
+    other row in the worksheet stays valid. Returns the number of rows cleared.
+    """
+    keep = set(timestamps)
+    updates = {}
+    for timestamp in [timestamp for timestamp in session['rows'] if timestamp not in keep]:
+        row = session['rows'].pop(timestamp)
+        sheet_id, worksheet, row_number = row['location']
+        updates.setdefault((sheet_id, worksheet), []).append(
+            f"{rowcol_to_a1(row_number, 1)}:{rowcol_to_a1(row_number, len(row['values']))}")
+
+    if updates:
+        client = authenticate_gsheets()
+        for (sheet_id, worksheet), ranges in updates.items():
+            client.open_by_key(sheet_id).worksheet(worksheet).batch_clear(ranges)
+    return sum(len(ranges) for ranges in updates.values())
+
+
+def sync_session(file_path, email, final=False):
+    """
+    Appends the newly completed minutes of a session to its sheet shard.
+
+    The ratio metrics are scaled to the maximum of the session so far, so the shard only ever holds
+    0-100 values. When a new maximum changes earlier minutes, only the cells whose values actually
+    changed are overwritten. Returns the per-sample metrics of the session, unscaled.
+
+    Parameters:
+    - file_path: Path to the raw CSV that is being recorded.
+    - email: The subject the session belongs to.
+    - final: Whether the recording has ended, in which case the minutes the batch upload trims
+      from the end of a session are cleared from the sheet.
+    """
+    state = read_live_state()
+    session = state.setdefault(session_name(file_path), {'email': email, 'last_timestamp': '', 'rows': {}})
+
+    samples, last_sample = read_samples(file_path)
+    if samples.empty:
+        # Record the session anyway, so batch runs already leave it alone
+        write_live_state(state)
+        return samples
+    normalized = samples.copy()
+    normalize_metric_columns(normalized)
+    bins = live_minute_bins(normalized, email, last_sample, final)
+
+    revised = revise_rows(session, bins)
+    if revised:
+        print(f"Revised {revised} rows of {session_name(file_path)}.")
+
+    serialized = serialize_for_sheets(bins)
+    timestamps = serialized['TimeStamp']
+    values = serialized.values.tolist()
+    new_rows = timestamps > session['last_timestamp']
+    if new_rows.any():
+        locations = upload_to_shards(bins[new_rows])
+        for index, location in locations.items():
+            session['rows'][timestamps[index]] = {'location': list(location), 'values': values[index]}
+        session['last_timestamp'] = timestamps[new_rows].max()
+
+    if final:
+        cleared = clear_rows(session, timestamps)
+        if cleared:
+            print(f"Cleared the last {cleared} rows of {session_name(file_path)}, which the batch upload trims.")
+
+    write_live_state(state)
+    return samples
+
+
+def finalize_session(file_path, email):
+    """
+    Brings the sheet rows of a finished session in line with the batch upload, then saves its
+    processed CSVs and sketches.
+    """
+    name = session_name(file_path)
+    samples = sync_session(file_path, email, final=True)
+
+    if not samples.empty:
+        archive_session(samples, email, name)
+
+    log_processed_file(name, email)
+    print(f"Session {name} finished.")
+
+
+def watch_session(file_path, email):
+    """
+    Uploads a session while it is being recorded, checking for new minutes every
+    upload_interval_seconds until the file stops growing for idle_timeout_seconds.
+    """
+    last_size = None
+    idle_since = time.time()
+
+    while True:
+        size = os.path.getsize(file_path)
+        if size != last_size:
+            last_size = size
+            idle_since = time.time()
+            sync_session(file_path, email)
+        elif time.time() - idle_since >= idle_timeout_seconds:
+            finalize_session(file_path, email)
+            break
+        time.sleep(upload_interval_seconds)
+
+
+def main():
+    file_path = sys.argv[1]
+    email = sys.argv[2] if len(sys.argv) > 2 else get_verified_email()
+    watch_session(file_path, email)
+
+
+if __name__ == "__main__":
+    main()
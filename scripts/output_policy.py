@@ -0,0 +1,51 @@
+# Per-sink output policies. Each sink only receives the columns its dashboard
+# reads, rounded to the precision it actually displays, so less data is serialized
+# and sent over the API.
+#
+# - columns: list of columns to keep (in this order), or None to keep every column.
+# - exclude: columns to drop, applied after 'columns'.
+# - decimals: number of decimals for all numeric columns, a dict of
+#   {column: decimals}, or None to keep full precision.
+output_policies = {
+    'sheets': {
+        'columns': None,
+        'exclude': [],
+        'decimals': 4,
+    },
+    'csv': {
+        'columns': None,
+        'exclude': [],
+        'decimals': None,
+    },
+}
+
+
+def apply_output_policy(df, sink):
+    """
+    Returns a copy of the DataFrame with the column selection and rounding of the given sink applied.
+
+    Parameters:
+    - df: The processed DataFrame.
+    - sink: The name of the sink in output_policies, e.g. 'sheets' or 'csv'.
+    """
+    try:
+        policy = output_policies[sink]
+    except KeyError:
+        raise ValueError(f"No output policy defined for sink '{sink}'")
+
+    columns = policy.get('columns')
+    if columns is not None:
+        df = df[[col for col in columns if col in df.columns]]
+
+    exclude = policy.get('exclude') or []
+    df = df.drop(columns=[col for col in exclude if col in df.columns])
+
+    df = df.copy()
+
+    # Round all float columns in one block operation instead of value by value
+    decimals = policy.get('decimals')
+    if decimals is not None:
+        float_cols = df.select_dtypes(include='float').columns
+        df[float_cols] = df[float_cols].round(decimals)
+
+    return df
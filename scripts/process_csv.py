@@ -1,8 +1,18 @@
-import os
+import json
+
 import pandas as pd
-from data_transformations_copy import clean_and_transform_data
-from upload_to_sheets import upload_to_sheet, sheet_id
+from data_transformations_copy import compute_sample_metrics, normalize_metric_columns, aggregate_minute_bins, aggregate_sliding_windows, cols
+from distribution_sketches import update_subject_sketches
+from output_policy import apply_output_policy
+from raw_input import list_sessions, open_session, session_name
+from sheet_shards import upload_to_shards
+
+# Sliding-window metrics saved next to the 1-minute bins, set to None to disable
+sliding_window_seconds = 30
+sliding_step_seconds = 1
 
+# Sessions being uploaded by live_upload.py, see read_live_state
+live_state_path = 'logs/live_uploads.json'
 
 
 def get_verified_email():
@@ -36,6 +46,17 @@ def read_processed_log():
     except FileNotFoundError:
         return {}
 
+def read_live_state():
+    """
+    Reads the state of the sessions uploaded by live_upload.py. Returns an empty state if none has been written yet.
+    A session listed here but not in the processed log is still being recorded and must not be batch-processed.
+    """
+    try:
+        with open(live_state_path, 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
 def log_processed_file(file_name, email):
     """
     Adds the given file name and email to the log of processed files.
@@ -44,39 +65,75 @@ def log_processed_file(file_name, email):
         file.write(f"{file_name}|{email}\n")
 
 
-def process_file(file_path, email):
-    # Load the CSV file
-    df = pd.read_csv(file_path)
+def process_file(file_path, email, member=None):
+    # Load the CSV file, streaming it out of the archive if it is compressed
+    with open_session(file_path, member) as stream:
+        df = pd.read_csv(stream)
     df['TimeStamp'] = pd.to_datetime(df['TimeStamp'])
     
     # Clean and transform the data
-    df = clean_and_transform_data(df)
+    samples = compute_sample_metrics(df, normalize=False)
+    df = archive_session(samples, email, session_name(file_path, member))
+
+    # Upload the processed DataFrame to its Google Sheets shard
+    upload_to_shards(df)
+
+
+def archive_session(samples, email, name):
+    """
+    Runs every step of processing a session except the upload: merges it into the subject's
+    sketches, scales the metrics to the session maximum, and saves the sliding-window and
+    1-minute CSVs. Returns the 1-minute bins.
+
+    Parameters:
+    - samples: The per-sample metrics from compute_sample_metrics(df, normalize=False). Normalized in place.
+    - email: The subject the session belongs to.
+    - name: The session name, see raw_input.session_name.
+    """
+    # Merge the session into the subject's distribution sketches for population analytics.
+    # This uses the raw metric ratios, before they are scaled to the session maximum.
+    update_subject_sketches(samples.drop(columns=cols), email, name)
+
+    normalize_metric_columns(samples)
+    df = aggregate_minute_bins(samples.copy())
     
     # Perform your data cleaning and transformations here
     df['Email'] = email
     
     # Define the path for the processed file
-    processed_path = f"data/processed/processed_{os.path.basename(file_path)}"
+    processed_path = f"data/processed/processed_{name}"
+
+    # Save the sliding-window metrics for neurofeedback-style visualizations
+    if sliding_window_seconds:
+        df_sliding = aggregate_sliding_windows(samples, sliding_window_seconds, sliding_step_seconds)
+        df_sliding['Email'] = email
+        sliding_path = f"data/processed/sliding_{name}"
+        apply_output_policy(df_sliding, 'csv').to_csv(sliding_path, index=False)
+        print(f"Sliding-window file saved to {sliding_path}")
     
     # Save the processed DataFrame
-    df.to_csv(processed_path, index=False)
+    apply_output_policy(df, 'csv').to_csv(processed_path, index=False)
     print(f"Processed file saved to {processed_path}")
-    # Upload the processed DataFrame to Google Sheets
-    upload_to_sheet(df, sheet_id)
+
+    return df
 
 def main():
     raw_folder = 'data/raw/'
     processed_files = read_processed_log()
+    live_sessions = read_live_state()
     
-    for file_name in os.listdir(raw_folder):
-        if file_name.endswith('.csv') and file_name not in processed_files:
-            file_path = os.path.join(raw_folder, file_name)
-            print(f"Processing {file_name}...")
+    for name, file_path, member in list_sessions(raw_folder):
+        if name in live_sessions and name not in processed_files:
+            print(f"Skipping {name}, it is being uploaded by live_upload.py.")
+        elif name not in processed_files:
+            print(f"Processing {name}...")
             email = get_verified_email()
-            process_file(file_path, email)
-            log_processed_file(file_name, email)
+            process_file(file_path, email, member)
+            log_processed_file(name, email)
+            # The same session can appear more than once, e.g. as .csv and .csv.gz
+            processed_files[name] = email
         else:
-            print(f"Skipping {file_name}, already processed or not a CSV file.")
+            print(f"Skipping {name}, already processed.")
 
 
 
@@ -0,0 +1,63 @@
+import gzip
+import os
+import zipfile
+from contextlib import contextmanager
+
+# Raw file types that can be read directly, without unpacking them to disk first
+raw_extensions = ('.csv', '.csv.gz', '.csv.zst', '.zip')
+
+
+def session_name(file_path, member=None):
+    """
+    Returns the name of the uncompressed CSV of a session, used for the processed log and output files.
+    """
+    name = os.path.basename(member) if member else os.path.basename(file_path)
+    if name.endswith(('.gz', '.zst')):
+        name = name.rsplit('.', 1)[0]
+    return name
+
+
+def list_sessions(raw_folder):
+    """
+    Lists every recording session in the raw folder, looking inside compressed files.
+    Returns a list of (session_name, file_path, member) tuples, where session_name is the
+    name of the uncompressed CSV and member is the file name inside a zip archive (or None).
+    """
+    sessions = []
+    for file_name in sorted(os.listdir(raw_folder)):
+        file_path = os.path.join(raw_folder, file_name)
+        if file_name.endswith('.zip'):
+            with zipfile.ZipFile(file_path) as archive:
+                for member in archive.namelist():
+                    if member.endswith('.csv') and not member.startswith('__MACOSX/'):
+                        sessions.append((session_name(file_path, member), file_path, member))
+        elif file_name.endswith(raw_extensions):
+            sessions.append((session_name(file_path), file_path, None))
+    return sessions
+
+
+@contextmanager
+def open_session(file_path, member=None):
+    """
+    Opens a raw session as a binary stream, decompressing on the fly.
+
+    Parameters:
+    - file_path: Path to a .csv, .csv.gz, .csv.zst or .zip file.
+    - member: The CSV file inside a zip archive.
+    """
+    if file_path.endswith('.zip'):
+        with zipfile.ZipFile(file_path) as archive, archive.open(member) as stream:
+            yield stream
+    elif file_path.endswith('.gz'):
+        with gzip.open(file_path, 'rb') as stream:
+            yield stream
+    elif file_path.endswith('.zst'):
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("Reading .zst files requires the 'zstandard' package: pipenv install zstandard")
+        with open(file_path, 'rb') as file, zstandard.ZstdDecompressor().stream_reader(file) as stream:
+            yield stream
+    else:
+        with open(file_path, 'rb') as stream:
+            yield stream
@@ -0,0 +1,219 @@
+import json
+
+import numpy as np
+
+from output_policy import apply_output_policy
+from upload_to_sheets import authenticate_gsheets, sheet_id
+
+# Local record of every shard that has been written to. Keeping it on disk means
+# we never have to read a worksheet back (get_all_values) just to find where to append.
+shard_map_path = 'logs/shard_map.json'
+
+# How rows are grouped into shards: 'subject', 'month' or 'subject_month'
+shard_strategy = 'subject_month'
+
+# Roll over to a new worksheet well before Google Sheets starts to slow down
+max_rows_per_shard = 20000
+max_cells_per_shard = 1500000
+
+# Google Sheets caps a whole spreadsheet at 10 million cells, stay under it
+max_cells_per_spreadsheet = 9000000
+
+# Drive folder new spreadsheets are created in, so they inherit its sharing (None for the service account's root)
+shard_folder_id = None
+
+# Addresses new spreadsheets are shared with. When empty, the sharing of the base spreadsheet is copied.
+share_with = []
+
+
+def read_shard_map():
+    """
+    Reads the local shard map. Returns an empty map if none has been written yet.
+    """
+    try:
+        with open(shard_map_path, 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {'shards': {}, 'spreadsheets': {}}
+
+
+def write_shard_map(shard_map):
+    """
+    Writes the shard map to disk.
+    """
+    with open(shard_map_path, 'w') as file:
+        json.dump(shard_map, file, indent=2)
+
+
+def shard_keys(df, strategy=shard_strategy):
+    """
+    Returns a Series with the shard key for every row of the DataFrame.
+
+    Parameters:
+    - df: The processed DataFrame, with a datetime 'TimeStamp' column and an 'Email' column.
+    - strategy: 'subject', 'month' or 'subject_month'.
+    """
+    subject = df['Email'].str.replace('@', '_at_', regex=False).str.replace('.', '_', regex=False)
+    month = df['TimeStamp'].dt.strftime('%Y-%m')
+    if strategy == 'subject':
+        return subject
+    if strategy == 'month':
+        return month
+    if strategy == 'subject_month':
+        return subject + '_' + month
+    raise ValueError(f"Unknown shard strategy '{strategy}'")
+
+
+def free_rows(shard, shard_map, n_cols):
+    """
+    Returns how many more rows fit in the shard, given both its own row/cell threshold
+    and the cells still free in its spreadsheet.
+    """
+    cols = max(shard['cols'], n_cols)
+    shard_rows = min(max_rows_per_shard, max_cells_per_shard // cols) - shard['rows']
+    spreadsheet_rows = (max_cells_per_spreadsheet - shard_map['spreadsheets'].get(shard['sheet_id'], 0)) // cols
+    return max(min(shard_rows, spreadsheet_rows), 0)
+
+
+def count_base_spreadsheet(client, shard_map):
+    """
+    Records the cells already used in the base spreadsheet (e.g. data appended to 'Sheet1'
+    before sharding) the first time it is used, so they count against its cell budget.
+    """
+    spreadsheets = shard_map['spreadsheets']
+    if sheet_id not in spreadsheets:
+        worksheets = client.open_by_key(sheet_id).worksheets()
+        spreadsheets[sheet_id] = sum(worksheet.row_count * worksheet.col_count for worksheet in worksheets)
+
+
+def share_new_spreadsheet(client, spreadsheet):
+    """
+    Shares a spreadsheet created by the service account with the dashboard users: with every
+    address in share_with, or else with everyone the base spreadsheet is shared with.
+    """
+    if share_with:
+        for email in share_with:
+            spreadsheet.share(email, perm_type='user', role='reader', notify=False)
+        return
+
+    for permission in client.open_by_key(sheet_id).list_permissions():
+        role = 'reader' if permission['role'] in ('reader', 'commenter') else 'writer'
+        if permission['type'] in ('user', 'group') and permission.get('emailAddress'):
+            spreadsheet.share(permission['emailAddress'], perm_type=permission['type'], role=role, notify=False)
+        elif permission['type'] == 'domain':
+            spreadsheet.share(permission['domain'], perm_type='domain', role=role, notify=False)
+        elif permission['type'] == 'anyone':
+            spreadsheet.share(None, perm_type='anyone', role=role)
+
+
+def open_new_shard(client, shard_map, key, n_cols):
+    """
+    Creates a new worksheet for the given shard key and records it in the shard map.
+    A new spreadsheet is created when the current one has no room left for it.
+    """
+    shards = shard_map['shards'].setdefault(key, [])
+    title = f"{key}_{len(shards) + 1:03d}"
+    spreadsheets = shard_map['spreadsheets']
+    target_id = list(spreadsheets)[-1] if spreadsheets else sheet_id
+
+    # Room for at least the header and one row
+    if spreadsheets.get(target_id, 0) + 2 * n_cols > max_cells_per_spreadsheet:
+        spreadsheet = client.create(f"Muse EEG {len(spreadsheets) + 1:03d}", folder_id=shard_folder_id)
+        share_new_spreadsheet(client, spreadsheet)
+        target_id = spreadsheet.id
+        # Reuse the default worksheet of the new spreadsheet instead of leaving it empty
+        worksheet = spreadsheet.sheet1
+        worksheet.update_title(title)
+        worksheet.resize(rows=1, cols=n_cols)
+    else:
+        spreadsheet = client.open_by_key(target_id)
+        worksheet = spreadsheet.add_worksheet(title=title, rows=1, cols=n_cols)
+
+    spreadsheets.setdefault(target_id, 0)
+    shard = {'sheet_id': target_id, 'worksheet': worksheet.title, 'rows': 0, 'cols': n_cols}
+    shards.append(shard)
+    return shard, worksheet
+
+
+def serialize_for_sheets(df, sink='sheets'):
+    """
+    Applies the sink's output policy and formats the timestamps as they are written to the sheet.
+    Missing values (e.g. a region whose channels all had bad contact) become empty cells,
+    since the Sheets API does not accept NaN.
+    """
+    df = apply_output_policy(df, sink)
+    float_cols = df.select_dtypes(include='float').columns
+    df[float_cols] = df[float_cols].astype(object).where(np.isfinite(df[float_cols]), '')
+    if 'TimeStamp' in df.columns:
+        df['TimeStamp'] = df['TimeStamp'].dt.strftime("%Y-%m-%d %H:%M:%S")
+    return df
+
+
+def upload_to_shards(df, strategy=shard_strategy, sink='sheets'):
+    """
+    Uploads a processed DataFrame to sharded worksheets, rolling over to a new
+    worksheet (or spreadsheet) when a shard reaches the row/cell threshold.
+    Returns a dict mapping each row index of df to its (sheet_id, worksheet, row number).
+
+    Parameters:
+    - df: The processed DataFrame, with a datetime 'TimeStamp' column and an 'Email' column.
+    - strategy: How rows are grouped into shards, see shard_keys.
+    - sink: The output policy to apply before serializing, see output_policy.
+    """
+    client = authenticate_gsheets()
+    shard_map = read_shard_map()
+
+    count_base_spreadsheet(client, shard_map)
+
+    keys = shard_keys(df, strategy)
+    df = serialize_for_sheets(df, sink)
+    header = df.columns.tolist()
+    n_cols = len(header)
+    locations = {}
+
+    for key, group in df.groupby(keys, sort=True):
+        values = group.values.tolist()
+        indices = group.index.tolist()
+        while values:
+            shards = shard_map['shards'].get(key)
+            worksheet = None
+            if shards and free_rows(shards[-1], shard_map, n_cols) > 0:
+                shard = shards[-1]
+            else:
+                shard, worksheet = open_new_shard(client, shard_map, key, n_cols)
+            if worksheet is None:
+                worksheet = client.open_by_key(shard['sheet_id']).worksheet(shard['worksheet'])
+
+            # Fill the shard up to its threshold and carry the rest over to the next one
+            n_rows = free_rows(shard, shard_map, n_cols)
+            if shard['rows'] == 0:
+                n_rows -= 1
+            batch, values = values[:n_rows], values[n_rows:]
+            batch_indices, indices = indices[:n_rows], indices[n_rows:]
+            if shard['rows'] == 0:
+                batch = [header] + batch
+            worksheet.append_rows(batch, value_input_option='USER_ENTERED')
+            first_row = shard['rows'] + len(batch) - len(batch_indices) + 1
+            for offset, index in enumerate(batch_indices):
+                locations[index] = (shard['sheet_id'], shard['worksheet'], first_row + offset)
+
+            # Charge the cells actually written to the spreadsheet's budget
+            shard['rows'] += len(batch)
+            shard['cols'] = max(shard['cols'], n_cols)
+            shard_map['spreadsheets'][shard['sheet_id']] += len(batch) * shard['cols']
+            write_shard_map(shard_map)
+
+            print(f"Data uploaded to Google Sheet with ID '{shard['sheet_id']}' in worksheet '{shard['worksheet']}'.")
+
+    return locations
+
+
+def list_shards(key=None):
+    """
+    Returns the (sheet_id, worksheet) pairs of every shard, or only those of the given key.
+    Looker Studio data sources can be built from this list and blended into one view.
+    """
+    shard_map = read_shard_map()
+    keys = [key] if key is not None else list(shard_map['shards'])
+    return [(shard['sheet_id'], shard['worksheet'])
+            for k in keys for shard in shard_map['shards'].get(k, [])]
@@ -15,7 +15,8 @@ from google.oauth2.service_account import Credentials  # to authenticate with Go
 
 
 sheet_id = "1zuRaVnBL3kEQH9UU2V9lXaAG_mKZZ9-d17LDQH6N1XM"
-scopes = ["https://www.googleapis.com/auth/spreadsheets"  ] # to read and write to Google Sheets
+scopes = ["https://www.googleapis.com/auth/spreadsheets",  # to read and write to Google Sheets
+          "https://www.googleapis.com/auth/drive"]  # to create new shard spreadsheets and copy the sharing of the base one
 # Function to authenticate with Google Sheets and return a client
 def authenticate_gsheets():
     """